@@ -0,0 +1,128 @@
+import hashlib
+import os
+
+import folium
+from branca.element import MacroElement
+from jinja2 import Template
+
+from boundaries import load_boundaries
+from incident_store import write_atomic
+
+# Served by Streamlit's static file handler (server.enableStaticServing in
+# .streamlit/config.toml) from this folder next to the app scripts, wherever
+# the app is started from.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BORDER_STYLE = {
+    'fillColor': 'transparent',
+    'color': '#bcbcbc',
+    'weight': 1,
+    'fillOpacity': 0,
+}
+
+
+class BorderLayer(MacroElement):
+    # Country borders fetched by the browser from static URLs instead of
+    # being inlined into the map script, so they are downloaded (and cached)
+    # once rather than re-sent on every rerun. `levels` lists
+    # [min_zoom, url] pairs in ascending zoom; the outline simplified for the
+    # current zoom is swapped in as the user zooms.
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var levels = {{ this.levels|tojson }};
+            var requests = {}, current = null, layer = null;
+            function showBorders() {
+                var url = levels[0][1];
+                levels.forEach(function(level) {
+                    if (map.getZoom() >= level[0]) { url = level[1]; }
+                });
+                if (url === current) { return; }
+                current = url;
+                requests[url] = requests[url] || fetch(url).then(function(response) { return response.json(); });
+                requests[url].then(function(data) {
+                    if (url !== current) { return; }
+                    if (layer) { map.removeLayer(layer); }
+                    layer = L.geoJson(data, {
+                        style: function() { return {{ this.style|tojson }}; },
+                        interactive: false
+                    }).addTo(map);
+                });
+            }
+            map.on('zoomend', showBorders);
+            showBorders();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, levels, style=BORDER_STYLE):
+        super().__init__()
+        self._name = 'BorderLayer'
+        self.levels = [[zoom, url] for zoom, url in levels]
+        self.style = style
+
+
+class FeatureProperties(MacroElement):
+    # Attaches GeoJSON properties to its parent marker. st_folium reports a
+    # clicked layer's toGeoJSON() as last_active_drawing, so the properties
+    # come back with the click.
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {{ this._parent.get_name() }}.feature = {type: 'Feature', properties: {{ this.properties|tojson }}};
+        {% endmacro %}
+    """)
+
+    def __init__(self, properties):
+        super().__init__()
+        self._name = 'FeatureProperties'
+        self.properties = properties
+
+
+# Writes the borders under a content-addressed name, so the browser may cache
+# them indefinitely and a new asset gets a new URL. Returns that URL.
+def publish_geojson(geojson, name, base_url_path=''):
+    data = geojson.encode()
+    filename = f"{name}.{hashlib.sha256(data).hexdigest()[:12]}.geojson"
+    path = os.path.join(STATIC_DIR, filename)
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        write_atomic(path, write)
+    prefix = f"/{base_url_path.strip('/')}" if base_url_path.strip('/') else ''
+    return f"{prefix}/app/static/{filename}"
+
+
+# One published outline per simplification level, as BorderLayer levels.
+def publish_boundaries(base_url_path=''):
+    return [(zoom, publish_geojson(geojson, f"world-z{zoom}", base_url_path))
+            for zoom, geojson in load_boundaries()]
+
+
+# The static part of the incident map. It is rebuilt identically on every
+# run, so st_folium keeps the mounted map and only swaps the incident layer
+# passed as feature_group_to_add.
+def create_base_map(border_levels):
+    m = folium.Map(location=[0, 0], zoom_start=3, tiles=None, max_bounds=True)
+
+    folium.TileLayer(
+        tiles='https://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}',
+        attr='Google',
+        name='Google Maps',
+        overlay=False,
+        control=True,
+        show=True,
+        no_wrap=True,
+        min_zoom=3,
+        max_zoom=18,
+        detect_retina=True,
+        opacity=1.0,
+        subdomains=['mt0', 'mt1', 'mt2', 'mt3'],
+        bounds=[[-90, -180], [90, 180]]
+    ).add_to(m)
+
+    BorderLayer(border_levels).add_to(m)
+    m.fit_bounds([[-90, -180], [90, 180]])
+    return m
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+
+from incident_store import write_atomic
+
+# Country outlines are the only thing the maps draw, so the bundled asset is
+# a GeoParquet file holding one multipolygon of every country per zoom level,
+# already simplified for that level. Rebuild it with
+#   python boundaries.py [source]
+BOUNDARIES_PATH = os.environ.get('BOUNDARIES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 'country_boundaries.parquet'))
+BOUNDARIES_SOURCE = "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_countries.geojson"
+# Douglas-Peucker tolerance in degrees from each zoom level up. Zoomed out a
+# pixel covers far more than these, so the coarse levels look the same while
+# being a fraction of the size.
+SIMPLIFY_TOLERANCES = {0: 0.2, 4: 0.05, 6: 0.0}
+
+
+def simplify(geometry, tolerance):
+    if tolerance > 0:
+        geometry = geometry.simplify(tolerance, preserve_topology=True)
+        # Digits finer than the tolerance only add bytes to the payload.
+        decimals = int(np.ceil(-np.log10(tolerance))) + 1
+        geometry = geometry.apply(lambda shape: shapely.transform(shape, lambda xy: xy.round(decimals)))
+    return shapely.multipolygons(shapely.get_parts(geometry[~geometry.is_empty].to_numpy()))
+
+
+# Only run to refresh the bundled asset, so geopandas and the network are
+# never needed by the apps themselves.
+def build_boundaries(source=BOUNDARIES_SOURCE, path=BOUNDARIES_PATH, tolerances=SIMPLIFY_TOLERANCES):
+    import geopandas as gpd
+
+    countries = gpd.read_file(source).geometry
+    zooms = sorted(tolerances)
+    boundaries = gpd.GeoDataFrame({'min_zoom': zooms},
+                                  geometry=[simplify(countries, tolerances[zoom]) for zoom in zooms],
+                                  crs=countries.crs)
+    write_atomic(path, lambda tmp_path: boundaries.to_parquet(tmp_path, compression='zstd'))
+    return boundaries
+
+
+# [min_zoom, GeoJSON] per level of the bundled asset. The geometry is stored
+# as WKB, so pyarrow and shapely are enough to read it.
+def load_boundaries(path=BOUNDARIES_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Country boundaries not found at {path}; rebuild them with `python boundaries.py`")
+    table = pq.read_table(path, columns=['min_zoom', 'geometry'])
+    geometry = shapely.from_wkb(table['geometry'].to_numpy(zero_copy_only=False))
+    return [(int(zoom), shapely.to_geojson(shape)) for zoom, shape in zip(table['min_zoom'].to_pylist(), geometry)]
+
+
+if __name__ == "__main__":
+    import sys
+
+    build_boundaries(*sys.argv[1:2])
+    print(f"{BOUNDARIES_PATH} ({os.path.getsize(BOUNDARIES_PATH) / 1024:.0f} KB)")
+    for zoom, geojson in load_boundaries():
+        print(f"zoom {zoom}+  tolerance {SIMPLIFY_TOLERANCES[zoom]}: {len(geojson) / 1024:.0f} KB GeoJSON")
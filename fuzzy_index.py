@@ -0,0 +1,102 @@
+from collections import defaultdict
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+from geocode_cache import normalize_place
+
+# How many trigram-overlap leaders get rescored with the (slow) Levenshtein
+# based scorer. Matches outside this shortlist share too few trigrams with the
+# query to reach the usual score thresholds anyway.
+SHORTLIST_SIZE = 50
+
+
+def trigrams(name):
+    padded = f"  {utils.full_process(name)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyCityIndex:
+    # Trigram index over worldcities.csv, partitioned by country so a
+    # misspelled city is only compared against cities in the incident's own
+    # country. Unknown countries fall back to the global partition.
+    def __init__(self, world_cities):
+        self._partitions = {'': self._build(world_cities['city'])}
+        for country, group in world_cities.groupby('country'):
+            partition = self._build(group['city'])
+            self._partitions[normalize_place(country)] = partition
+            for code_col in ('iso2', 'iso3'):
+                if code_col in group:
+                    self._partitions.setdefault(normalize_place(group[code_col].iloc[0]), partition)
+
+    @staticmethod
+    def _build(cities):
+        names = np.asarray(sorted(set(cities.dropna().astype(str))), dtype=object)
+        postings = defaultdict(list)
+        for i, name in enumerate(names):
+            for gram in trigrams(name):
+                postings[gram].append(i)
+        return names, {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def extract(self, city_name, country=None, limit=5):
+        # Blank (NaN/None) cells have nothing to match.
+        if not isinstance(city_name, str):
+            return []
+        names, postings = self._partitions.get(normalize_place(country), self._partitions[''])
+        hits = [postings[gram] for gram in trigrams(city_name) if gram in postings]
+        if not hits:
+            return []
+        overlap = np.bincount(np.concatenate(hits), minlength=len(names))
+        size = min(SHORTLIST_SIZE, len(names))
+        shortlist = np.argpartition(overlap, -size)[-size:]
+        shortlist = shortlist[overlap[shortlist] > 0]
+        # WRatio is the scorer process.extract uses, so scores and thresholds
+        # stay comparable with the full scan this replaces.
+        scored = [(names[i], fuzz.WRatio(city_name, names[i])) for i in shortlist]
+        scored.sort(key=lambda match: match[1], reverse=True)
+        return scored[:limit]
+
+
+if __name__ == "__main__":
+    # Compares the index against the full process.extract scan:
+    #   python fuzzy_index.py [worldcities.csv]
+    import random
+    import string
+    import sys
+    import time
+
+    import pandas as pd
+    from fuzzywuzzy import process
+
+    if len(sys.argv) > 1:
+        world_cities = pd.read_csv(sys.argv[1])
+    else:
+        rng = random.Random(0)
+        world_cities = pd.DataFrame({
+            'city': [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))).title()
+                     for _ in range(40000)],
+            'country': [f"Country {rng.randint(0, 200)}" for _ in range(40000)],
+        })
+
+    start = time.perf_counter()
+    index = FuzzyCityIndex(world_cities)
+    print(f"build: {time.perf_counter() - start:.2f}s")
+
+    sample = world_cities.sample(200, random_state=0)
+    # Drop a character so every query is a genuine misspelling.
+    queries = [(city[:len(city) // 2] + city[len(city) // 2 + 1:], country)
+               for city, country in zip(sample['city'], sample['country'])]
+    cities = world_cities['city'].unique()
+
+    start = time.perf_counter()
+    for city, country in queries:
+        index.extract(city, country)
+    indexed = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    for city, _ in queries[:20]:
+        process.extract(city, cities, limit=5)
+    full_scan = (time.perf_counter() - start) / 20
+
+    print(f"index: {indexed * 1000:.3f} ms/query  full scan: {full_scan * 1000:.1f} ms/query  "
+          f"speed-up: {full_scan / indexed:.0f}x")
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH', 'geocode_cache.sqlite')
+# Failed lookups are remembered for a week so a cold start doesn't retry every
+# unknown city, but a later Nominatim fix still gets picked up.
+NEGATIVE_TTL = float(os.environ.get('GEOCODE_NEGATIVE_TTL', 7 * 24 * 3600))
+
+# Returned by GeocodeCache.get when the store has no usable entry. A cached
+# failure is returned as None, so callers must compare against MISS.
+MISS = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    city TEXT NOT NULL,
+    country TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    provider TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (city, country)
+)
+"""
+
+UPSERT = """
+INSERT INTO geocodes (city, country, lat, lon, provider, updated_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (city, country) DO UPDATE SET
+    lat = excluded.lat,
+    lon = excluded.lon,
+    provider = excluded.provider,
+    updated_at = excluded.updated_at
+"""
+
+
+def normalize_place(name):
+    if name is None or name != name:
+        return ''
+    name = unicodedata.normalize('NFKC', str(name)).casefold()
+    return ' '.join(name.split())
+
+
+class GeocodeCache:
+    def __init__(self, path=GEOCODE_CACHE_PATH, negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, and Streamlit
+        # runs each session on its own thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL lets the two apps (and every server worker) read while one
+            # of them is writing; the busy timeout serialises the writers.
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.execute(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _is_fresh(self, lat, updated_at, now):
+        return lat is not None or now - updated_at < self.negative_ttl
+
+    def get(self, city, country):
+        row = self._connection().execute(
+            'SELECT lat, lon, updated_at FROM geocodes WHERE city = ? AND country = ?',
+            (normalize_place(city), normalize_place(country)),
+        ).fetchone()
+        if row is None:
+            return MISS
+        lat, lon, updated_at = row
+        if not self._is_fresh(lat, updated_at, time.time()):
+            return MISS
+        return None if lat is None else (lat, lon)
+
+    def put(self, city, country, coords, provider):
+        lat, lon = coords if coords else (None, None)
+        conn = self._connection()
+        with conn:
+            conn.execute(UPSERT, (normalize_place(city), normalize_place(country),
+                                  lat, lon, provider, time.time()))
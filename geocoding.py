@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from geopy.exc import GeocoderRateLimited, GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+from geopy.geocoders import Nominatim
+
+from geocode_cache import GeocodeCache, MISS, normalize_place
+
+# 'hybrid' resolves from worldcities.csv and only asks Nominatim on a miss,
+# 'offline' never touches the network (air-gapped deployments) and 'online'
+# skips the local table.
+GEOCODER_MODE = os.environ.get('GEOCODER_MODE', 'hybrid')
+WORLD_CITIES_PATH = os.environ.get('WORLD_CITIES_PATH', 'worldcities.csv')
+# Point these at a self-hosted Nominatim (or the stub in __main__) to lift
+# the public server's one-request-per-second limit.
+NOMINATIM_DOMAIN = os.environ.get('NOMINATIM_DOMAIN', 'nominatim.openstreetmap.org')
+NOMINATIM_SCHEME = os.environ.get('NOMINATIM_SCHEME', 'https')
+# Nominatim's usage policy allows one request per second per client.
+REQUESTS_PER_SECOND = float(os.environ.get('GEOCODE_RPS', 1))
+MAX_IN_FLIGHT = int(os.environ.get('GEOCODE_MAX_IN_FLIGHT', 4))
+MAX_RETRIES = int(os.environ.get('GEOCODE_MAX_RETRIES', 3))
+BACKOFF_SECONDS = float(os.environ.get('GEOCODE_BACKOFF', 2))
+
+RETRYABLE_ERRORS = (GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable)
+
+geocode_cache = GeocodeCache()
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LookupFailed(Exception):
+    pass
+
+
+class LookupCancelled(Exception):
+    pass
+
+
+_world_cities = None
+_city_index = None
+_geolocator = None
+_geolocator_lock = threading.Lock()
+_rate_limiters = {}
+_in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+
+def get_geolocator():
+    # One client for the whole process so its HTTP session (and connection
+    # pool) is reused across lookups.
+    global _geolocator
+    with _geolocator_lock:
+        if _geolocator is None:
+            _geolocator = Nominatim(user_agent="my_app", timeout=10,
+                                    domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+        return _geolocator
+
+
+# Maps normalised (city, country) to coordinates. Both the native and ASCII
+# spellings are indexed, against the country name as well as its ISO codes;
+# where a name repeats within a country the most populous city wins.
+def build_city_index(world_cities):
+    if 'population' in world_cities:
+        world_cities = world_cities.sort_values('population', ascending=False)
+    index = {}
+    for name_col in ('city', 'city_ascii'):
+        for country_col in ('country', 'iso2', 'iso3'):
+            if name_col not in world_cities or country_col not in world_cities:
+                continue
+            keys = zip(world_cities[name_col].map(normalize_place),
+                       world_cities[country_col].map(normalize_place))
+            for key, lat, lng in zip(keys, world_cities['lat'], world_cities['lng']):
+                index.setdefault(key, (float(lat), float(lng)))
+    return index
+
+
+# The city table is read once per process and shared with the fuzzy matcher.
+# None when there is no table.
+def get_world_cities():
+    global _world_cities
+    with _geolocator_lock:
+        if _world_cities is None and os.path.exists(WORLD_CITIES_PATH):
+            _world_cities = pd.read_csv(WORLD_CITIES_PATH)
+        return _world_cities
+
+
+def get_city_index():
+    global _city_index
+    world_cities = get_world_cities()
+    with _geolocator_lock:
+        if _city_index is None:
+            _city_index = build_city_index(world_cities) if world_cities is not None else {}
+        return _city_index
+
+
+def get_rate_limiter(host):
+    with _geolocator_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = RateLimiter(REQUESTS_PER_SECOND)
+        return _rate_limiters[host]
+
+
+def query_nominatim(city, country, cancel=None):
+    geolocator = get_geolocator()
+    rate_limiter = get_rate_limiter(geolocator.domain)
+    for attempt in range(MAX_RETRIES + 1):
+        with _in_flight:
+            rate_limiter.wait()
+            if cancel is not None and cancel.is_set():
+                raise LookupCancelled(f"{city}, {country}")
+            try:
+                location = geolocator.geocode(f"{city}, {country}")
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise LookupFailed(f"{city}, {country}") from e
+            except GeocoderServiceError as e:
+                raise LookupFailed(f"{city}, {country}") from e
+            else:
+                return (location.latitude, location.longitude) if location else None
+        time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+
+def geocode(city, country, cancel=None):
+    if GEOCODER_MODE != 'online':
+        coords = get_city_index().get((normalize_place(city), normalize_place(country)))
+        if coords is not None or GEOCODER_MODE == 'offline':
+            return coords
+    coords = geocode_cache.get(city, country)
+    if coords is not MISS:
+        return coords
+    try:
+        coords = query_nominatim(city, country, cancel)
+    except (LookupFailed, LookupCancelled):
+        # Transient errors aren't cached so the next run can retry them.
+        return None
+    geocode_cache.put(city, country, coords, 'nominatim')
+    return coords
+
+
+# Fuzzy candidates for the same city are raced against each other; the first
+# one that resolves wins and the rest are cancelled before they hit the
+# network (those already in flight are left to finish and get cached).
+def race_candidates(candidates, country, executor):
+    cancel = threading.Event()
+    pending = {executor.submit(geocode, match, country, cancel): match for match in candidates}
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                match = pending.pop(future)
+                coords = future.result()
+                if coords:
+                    return match, coords
+    finally:
+        cancel.set()
+        for future in pending:
+            future.cancel()
+    return None, None
+
+
+def resolve_location(city, country, fuzzy_match, candidate_executor):
+    coords = geocode(city, country)
+    if coords is None and fuzzy_match is not None:
+        match, match_coords = race_candidates(fuzzy_match(city, country), country, candidate_executor)
+        if match_coords:
+            return match, match_coords
+    return city, coords
+
+
+# Returns a frame aligned with data holding float64 lat/lon (NaN where the
+# location couldn't be resolved) and the (possibly spelling-corrected) City. Each distinct (City, Country) pair is resolved
+# once, however many incidents share it, with up to MAX_IN_FLIGHT requests
+# outstanding at a time.
+def batch_geocode(data, fuzzy_match=None):
+    pairs = data[['City', 'Country']].drop_duplicates()
+    # Candidate lookups get their own pool so a pair worker waiting on its
+    # candidates can never starve them of threads.
+    with ThreadPoolExecutor(MAX_IN_FLIGHT) as pair_executor, \
+            ThreadPoolExecutor(MAX_IN_FLIGHT) as candidate_executor:
+        resolved = list(pair_executor.map(
+            lambda pair: resolve_location(pair[0], pair[1], fuzzy_match, candidate_executor),
+            pairs.itertuples(index=False)))
+    coords = np.array([coords or (np.nan, np.nan) for _, coords in resolved],
+                      dtype='float64').reshape(-1, 2)
+    lookup = pd.DataFrame({'City': [city for city, _ in resolved], 'lat': coords[:, 0], 'lon': coords[:, 1]},
+                          index=pd.MultiIndex.from_frame(pairs))
+    result = lookup.reindex(pd.MultiIndex.from_frame(data[['City', 'Country']]))
+    result.index = data.index
+    return result
+
+
+def serve_stub_geocoder(port, latency):
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = json.dumps([{'lat': '1.0', 'lon': '2.0', 'display_name': self.path}]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # Wall-clock benchmark against a local stub geocoder:
+    #   python geocoding.py [pairs] [latency_seconds]
+    import sys
+    import tempfile
+
+    n_pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    server = serve_stub_geocoder(0, latency)
+    NOMINATIM_DOMAIN = f"127.0.0.1:{server.server_port}"
+    NOMINATIM_SCHEME = 'http'
+    REQUESTS_PER_SECOND = 1000
+    GEOCODER_MODE = 'online'
+    data = pd.DataFrame({'City': [f"city{i}" for i in range(n_pairs)], 'Country': 'Nowhere'})
+
+    for in_flight in (1, MAX_IN_FLIGHT, 4 * MAX_IN_FLIGHT):
+        with tempfile.TemporaryDirectory() as tmp:
+            geocode_cache = GeocodeCache(os.path.join(tmp, 'bench.sqlite'))
+            MAX_IN_FLIGHT = in_flight
+            _in_flight = threading.BoundedSemaphore(in_flight)
+            _rate_limiters.clear()
+            start = time.perf_counter()
+            batch_geocode(data)
+            elapsed = time.perf_counter() - start
+        print(f"in-flight={in_flight:3d}  {n_pairs} lookups  {elapsed:.2f}s")
+    server.shutdown()
@@ -0,0 +1,135 @@
+import functools
+import os
+import threading
+
+from fuzzy_index import FuzzyCityIndex
+from geocoding import batch_geocode, get_world_cities
+from incident_index import IncidentIndex, tokenize
+from incident_store import INCIDENTS_PATH, load_processed_incidents
+from result_cache import ResultCache, facets_key
+from rollup_cube import CountCube, count_by
+from table_pages import sort_ranks
+
+FUZZY_CACHE_SIZE = 100000
+
+_fuzzy_index = None
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_fuzzy_index():
+    global _fuzzy_index
+    world_cities = get_world_cities()
+    with _engines_lock:
+        if _fuzzy_index is None and world_cities is not None:
+            _fuzzy_index = FuzzyCityIndex(world_cities)
+        return _fuzzy_index
+
+
+@functools.lru_cache(maxsize=FUZZY_CACHE_SIZE)
+def fuzzy_match_city(city_name, country=None, limit=5, threshold=70):
+    fuzzy_index = get_fuzzy_index()
+    # Without the world cities table there is nothing to correct against.
+    if fuzzy_index is None:
+        return []
+    matches = fuzzy_index.extract(city_name, country, limit=limit)
+    return [match for match, score in matches if score >= threshold]
+
+
+def preprocess_data(data):
+    result = batch_geocode(data, fuzzy_match_city)
+    data['City'] = result['City']
+    data['lat'] = result['lat']
+    data['lon'] = result['lon']
+    return data
+
+
+def facet_filters(type_filter, category_filter, country_filter, impact_filter, severity_filter):
+    return {
+        'Type': type_filter,
+        'Category': category_filter,
+        'Country': country_filter,
+        'Impact': impact_filter,
+        'Severity': severity_filter,
+    }
+
+
+class IncidentView:
+    # One version of the incident table (all of it, or only the geocoded
+    # rows) with everything the apps query it through: the filter index,
+    # the chart count cube and the sort ranks of whichever columns a Data tab
+    # has asked for.
+    # `version` names the table cheaply for result caches, and query_key()
+    # the filters applied to it, so nothing derived from the table has to be
+    # hashed to be looked up.
+    def __init__(self, data, cube, version=None, results=None):
+        self.index = IncidentIndex(data)
+        self.data = self.index.data
+        self.cube = cube
+        self.cube.sync(self.data)
+        self.version = version
+        self.results = results if results is not None else ResultCache()
+        self._ranks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def query_key(facets, start_date, end_date, search_term=''):
+        return (facets_key(facets), start_date, end_date, ' '.join(tokenize(search_term)))
+
+    def cached(self, name, query, compute):
+        return self.results.get((name, self.version, query), compute)
+
+    def filter(self, facets, start_date, end_date, search_term=''):
+        query = self.query_key(facets, start_date, end_date, search_term)
+        return self.cached('filter', query, lambda: self.index.filter(facets, start_date, end_date, search_term))
+
+    def counts(self, filtered_data, column, facets, start_date, end_date, search_term=''):
+        query = (column, self.query_key(facets, start_date, end_date, search_term))
+        return self.cached('counts', query, lambda: count_by(self.cube, filtered_data, column, facets,
+                                                              start_date, end_date, search_term))
+
+    # Built once per column and dataset version, on first use.
+    def sort_ranks(self, columns):
+        with self._lock:
+            missing = [column for column in columns if column not in self._ranks]
+            if missing:
+                self._ranks.update(sort_ranks(self.data, missing))
+            return {column: self._ranks[column] for column in columns}
+
+
+class IncidentEngine:
+    # Owns loading, geocoding, indexing and filtering of one incident sheet
+    # for the whole process, so both front-ends share everything built from
+    # the table. The sheet is re-read when its mtime or size changes. The
+    # table itself is memory-mapped from the processed-table cache (see
+    # incident_store.read_arrow), so every process reading the same sheet
+    # shares one copy of it, as they share the geocode store.
+    def __init__(self, source_path=INCIDENTS_PATH):
+        self.source_path = source_path
+        self._lock = threading.Lock()
+        self._version = None
+        self._views = {}
+        # Kept across versions so appended rows are merged in, not recounted.
+        self._cubes = {False: CountCube(), True: CountCube()}
+        # Shared by every view; entries of replaced versions age out.
+        self.results = ResultCache()
+
+    def view(self, located_only=False):
+        stat = os.stat(self.source_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if version != self._version:
+                self._views = {}
+                self._version = version
+            if located_only not in self._views:
+                data = load_processed_incidents(preprocess_data, self.source_path, located_only)
+                self._views[located_only] = IncidentView(data, self._cubes[located_only],
+                                                         (self.source_path, located_only) + version, self.results)
+            return self._views[located_only]
+
+
+def get_engine(source_path=INCIDENTS_PATH):
+    with _engines_lock:
+        if source_path not in _engines:
+            _engines[source_path] = IncidentEngine(source_path)
+        return _engines[source_path]
@@ -0,0 +1,44 @@
+import gzip
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from table_pages import format_page
+
+EXPORT_CHUNK_ROWS = 50000
+# Label -> (file extension, MIME type).
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'CSV (gzip)': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def csv_chunks(data, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, max(len(data), 1), chunk_rows):
+        chunk = format_page(data.iloc[start:start + chunk_rows])
+        yield chunk.to_csv(index=False, header=start == 0)
+
+
+# Writes `data` in the given format a chunk of rows at a time, so only one
+# formatted chunk exists beside the output, and returns the output buffer.
+# Meant to be passed (via a lambda) as the data of st.download_button, so
+# nothing is built until someone asks for it.
+def export_file(data, extension, chunk_rows=EXPORT_CHUNK_ROWS):
+    output = io.BytesIO()
+    if extension == 'parquet':
+        # Dates stay typed here; one row group per chunk.
+        schema = pa.Schema.from_pandas(data.iloc[:0], preserve_index=False)
+        with pq.ParquetWriter(output, schema) as writer:
+            for start in range(0, len(data), chunk_rows):
+                writer.write_table(pa.Table.from_pandas(data.iloc[start:start + chunk_rows], schema, preserve_index=False))
+    elif extension == 'csv.gz':
+        with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6) as compressed:
+            for chunk in csv_chunks(data, chunk_rows):
+                compressed.write(chunk.encode())
+    else:
+        for chunk in csv_chunks(data, chunk_rows):
+            output.write(chunk.encode())
+    output.seek(0)
+    return output
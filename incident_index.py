@@ -0,0 +1,165 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+FACET_COLUMNS = ['Type', 'Category', 'Country', 'Impact', 'Severity']
+TEXT_COLUMNS = ['Title', 'Country', 'City']
+TOKEN_PATTERN = r'\w+'
+
+
+def tokenize(text):
+    return re.findall(TOKEN_PATTERN, text.casefold())
+
+
+# Sorted the way the incident store writes the table: known dates ascending,
+# blank (NaT) ones last, where searchsorted also places them.
+# is_monotonic_increasing alone is False as soon as any NaT is present.
+def date_ordered(dates):
+    known = dates.notna().to_numpy()
+    count = int(known.sum())
+    return bool(known[:count].all()) and dates.iloc[:count].is_monotonic_increasing
+
+
+class IncidentIndex:
+    # Built once per dataset version. The table is kept sorted by Date so a
+    # date range is a contiguous slice found by binary search, and every
+    # distinct value of every facet gets a packed bitmap of the rows holding
+    # it, so a filter change is a handful of byte-wise OR/AND operations over
+    # that slice and a single take from the table. Title, Country and City
+    # are tokenised into an inverted index whose sorted vocabulary answers
+    # prefix queries by binary search.
+    def __init__(self, data):
+        if not date_ordered(data['Date']):
+            data = data.sort_values('Date', kind='stable').reset_index(drop=True)
+        self.data = data
+        self.size = len(data)
+        self._dates = data['Date'].to_numpy()
+        self._bitmaps = {}
+        for column in FACET_COLUMNS:
+            codes, values = pd.factorize(data[column])
+            self._bitmaps[column] = {value: np.packbits(codes == i) for i, value in enumerate(values)}
+        self._build_text_index(data)
+
+    def _build_text_index(self, data):
+        pairs = []
+        for column in TEXT_COLUMNS:
+            # Tokenise each distinct value once; Country and City repeat a lot.
+            codes, values = pd.factorize(data[column])
+            tokens = (pd.Series(values, dtype=object).astype(str).str.casefold()
+                      .str.findall(TOKEN_PATTERN).explode().dropna())
+            value_tokens = pd.DataFrame({'code': tokens.index.to_numpy(), 'term': tokens.to_numpy()})
+            rows = pd.DataFrame({'code': codes, 'row': np.arange(self.size)})
+            pairs.append(rows.merge(value_tokens, on='code')[['term', 'row']])
+        pairs = pd.concat(pairs, ignore_index=True)
+        term_codes, terms = pd.factorize(pairs['term'], sort=True)
+        self._terms = np.asarray(terms, dtype=object)
+        postings = pd.DataFrame({'term': term_codes, 'row': pairs['row'].to_numpy()})
+        postings = postings.drop_duplicates().sort_values(['term', 'row'])
+        self._postings = postings['row'].to_numpy()
+        self._term_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(postings['term'], minlength=len(self._terms)))])
+
+    def _rows_with_prefix(self, prefix):
+        first = np.searchsorted(self._terms, prefix, 'left')
+        last = np.searchsorted(self._terms, prefix + '\U0010ffff', 'left')
+        rows = self._postings[self._term_offsets[first]:self._term_offsets[last]]
+        return rows if last - first == 1 else np.unique(rows)
+
+    # Every word of the query has to start some word of the incident's Title,
+    # Country or City, so "chem spill" finds "Chemical spill in Ohio".
+    def search(self, search_term):
+        rows = None
+        for token in tokenize(search_term):
+            matches = self._rows_with_prefix(token)
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        return rows
+
+    # Whole days from the From date through the To date, the same rule the
+    # chart count cube uses, so charts always agree with the table.
+    def date_range(self, start_date, end_date):
+        start = pd.Timestamp(start_date).normalize().to_datetime64().astype(self._dates.dtype)
+        end = (pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)).to_datetime64().astype(self._dates.dtype)
+        first = int(np.searchsorted(self._dates, start, 'left'))
+        # A From date after the To date selects nothing.
+        return first, max(first, int(np.searchsorted(self._dates, end, 'left')))
+
+    def facet_mask(self, facets, start=0, stop=None):
+        stop = self.size if stop is None else stop
+        # Only the bytes covering rows [start, stop) are touched.
+        first_byte, last_byte = start // 8, (stop + 7) // 8
+        combined = None
+        for column, selected in facets.items():
+            if not selected:
+                continue
+            bitmaps = self._bitmaps[column]
+            facet = np.zeros(last_byte - first_byte, dtype=np.uint8)
+            for value in selected:
+                if value in bitmaps:
+                    facet |= bitmaps[value][first_byte:last_byte]
+            combined = facet if combined is None else combined & facet
+        if combined is None:
+            return np.ones(stop - start, dtype=bool)
+        offset = start - first_byte * 8
+        return np.unpackbits(combined)[offset:offset + stop - start].astype(bool)
+
+    def select(self, facets, start_date, end_date, search_term=''):
+        start, stop = self.date_range(start_date, end_date)
+        mask = self.facet_mask(facets, start, stop)
+        matches = self.search(search_term) if search_term else None
+        if matches is None:
+            return start + np.flatnonzero(mask)
+        matches = matches[(matches >= start) & (matches < stop)]
+        return matches[mask[matches - start]]
+
+    def filter(self, facets, start_date, end_date, search_term=''):
+        return self.data.iloc[self.select(facets, start_date, end_date, search_term)]
+
+
+if __name__ == "__main__":
+    # Checks select() against plain pandas filtering of the same table, over
+    # random facets, date ranges (reversed ones too) and prefix searches:
+    #   python incident_index.py [rows]
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rng = np.random.default_rng(0)
+    words = ['gas', 'leak', 'chemical', 'spill', 'blast', 'explosion', 'suspicious', 'package', 'powder', 'drill']
+    data = pd.DataFrame({
+        'Type': rng.choice(['Incident', 'Activity'], n),
+        'Category': rng.choice(['Explosive', 'Biological', 'Radiological', 'Chemical', 'Nuclear'], n),
+        'Country': rng.choice(['France', 'India', 'Canada', 'United Arab Emirates'], n),
+        'Impact': rng.choice(['Human', 'Infrastructure'], n),
+        'Severity': rng.choice(['Low', 'Medium', 'High'], n),
+        'Title': [' '.join(rng.choice(words, 3)).capitalize() for _ in range(n)],
+        'City': pd.Series(rng.choice(['Paris', 'New Delhi', 'Toronto', 'Dubai'], n)).mask(rng.random(n) < 0.05),
+        # Times of day and blank dates, stored the way the incident store does.
+        'Date': pd.Series(pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 86400, n), unit='s'))
+                .mask(rng.random(n) < 0.01),
+    }).sort_values('Date', kind='stable').reset_index(drop=True)
+    index = IncidentIndex(data)
+    assert index.data is data
+
+    row_words = [set(tokenize(' '.join(str(value) for value in row if value == value)))
+                 for row in data[TEXT_COLUMNS].itertuples(index=False)]
+    vocabulary = set().union(*row_words)
+    has_word = {word: np.array([word in found for found in row_words]) for word in vocabulary}
+    days = data['Date'].dropna().dt.normalize().unique()
+
+    for _ in range(200):
+        facets = {column: list(rng.choice(data[column].unique(), int(rng.integers(1, 3)), replace=False))
+                  for column in FACET_COLUMNS if rng.random() < 0.3}
+        start_date, end_date = (pd.Timestamp(day) for day in rng.choice(days, 2))
+        query = ' '.join(word[:int(rng.integers(1, len(word) + 1))] for word in rng.choice(words + ['dub', 'paris'],
+                                                                                         int(rng.integers(0, 3))))
+        expected = np.ones(n, dtype=bool)
+        for column, selected in facets.items():
+            expected &= data[column].isin(selected).to_numpy()
+        expected &= ((data['Date'] >= start_date.normalize()) &
+                     (data['Date'] < end_date.normalize() + pd.Timedelta(days=1))).to_numpy()
+        for token in tokenize(query):
+            expected &= np.any([has_word[word] for word in vocabulary if word.startswith(token)] or [np.zeros(n, bool)],
+                               axis=0)
+        got = index.select(facets, start_date, end_date, query)
+        assert np.array_equal(got, np.flatnonzero(expected)), (facets, start_date, end_date, query)
+    print(f"IncidentIndex.select matches pandas filtering on {n} rows")
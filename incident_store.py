@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+INCIDENTS_PATH = 'News GIS.xlsx'
+CACHE_DIR = os.environ.get('INCIDENT_CACHE_DIR', '.cache')
+
+CATEGORICAL_COLUMNS = ['Type', 'Category', 'Country', 'Impact', 'Severity']
+STRING_COLUMNS = ['Title', 'City', 'Link']
+FLOAT_COLUMNS = ['lat', 'lon']
+
+
+def cache_paths(source_path, kind='incidents'):
+    stem = os.path.splitext(os.path.basename(source_path))[0].replace(' ', '_')
+    return (os.path.join(CACHE_DIR, f"{stem}.{kind}.arrow"),
+            os.path.join(CACHE_DIR, f"{stem}.{kind}.manifest.json"))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, write):
+    # Write beside the target and rename over it, so a concurrent reader in
+    # another app or worker never sees a half-written file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+
+def read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def matches_stat(manifest, stat):
+    return manifest.get('mtime_ns') == stat.st_mtime_ns and manifest.get('size') == stat.st_size
+
+
+# Tables are written uncompressed as a single record batch, and converted
+# without consolidating pandas blocks, so numeric and string columns stay
+# read-only views of the memory-mapped file: every process reading a table
+# shares the page cache instead of holding its own copy (point
+# INCIDENT_CACHE_DIR at /dev/shm to keep it in RAM). Only categorical codes
+# are materialised.
+def read_arrow(path):
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def write_arrow(path, data):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(data).combine_chunks()
+    write_atomic(path, lambda tmp_path: feather.write_feather(
+        table, tmp_path, compression='uncompressed', chunksize=max(len(data), 1)))
+
+
+def read_incident_sheet(source_path):
+    data = pd.read_excel(source_path, engine='openpyxl')
+    data['Date'] = pd.to_datetime(data['Date'])
+    for column in CATEGORICAL_COLUMNS + STRING_COLUMNS:
+        if column in data and pd.api.types.is_string_dtype(data[column]):
+            # Analysts type these by hand; 'Malaysia ' and 'Malaysia' are the
+            # same country.
+            data[column] = data[column].str.strip()
+    for column in CATEGORICAL_COLUMNS:
+        if column in data:
+            data[column] = data[column].astype('category')
+    for column in FLOAT_COLUMNS:
+        if column in data:
+            data[column] = data[column].astype('float64')
+    return data
+
+
+# The sheet is converted once into an uncompressed Arrow file and later loads
+# memory-map it instead of re-parsing the XLSX. The cache is keyed by the
+# sheet's mtime and size, falling back to a content hash so a touch or a
+# re-save without changes doesn't force a rebuild.
+def load_incidents(source_path=INCIDENTS_PATH):
+    cache_path, manifest_path = cache_paths(source_path)
+    stat = os.stat(source_path)
+    manifest = read_manifest(manifest_path)
+    if os.path.exists(cache_path) and matches_stat(manifest, stat):
+        return read_arrow(cache_path)
+
+    sha256 = file_sha256(source_path)
+    if manifest.get('sha256') == sha256 and os.path.exists(cache_path):
+        data = read_arrow(cache_path)
+    else:
+        data = read_incident_sheet(source_path)
+        write_arrow(cache_path, data)
+    manifest = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256}
+    write_atomic(manifest_path, lambda path: write_json(path, manifest))
+    return data
+
+
+# A row is identified by its Link, or by Title and Date for rows without one.
+# The occurrence number keeps keys unique when the same article is entered
+# twice.
+def row_keys(data):
+    fallback = data['Title'].astype('string') + '|' + data['Date'].astype('string')
+    key = data['Link'].astype('string').fillna(fallback) if 'Link' in data else fallback
+    return key + '#' + key.groupby(key).cumcount().astype('string')
+
+
+def row_hashes(data):
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+# Returns the geocoded incident table, only running `preprocess` over rows
+# that are new or changed since the last run (plus any that previously failed
+# to resolve, which the geocode store answers without the network until its
+# negative TTL expires). `preprocess` takes a frame of raw rows and returns it
+# with a corrected City and float lat/lon columns. With located_only, only
+# the rows that have coordinates are returned; that subset is stored as its
+# own table so it can be memory-mapped too.
+def load_processed_incidents(preprocess, source_path=INCIDENTS_PATH, located_only=False):
+    cache_path, manifest_path = cache_paths(source_path, 'processed')
+    located_path, _ = cache_paths(source_path, 'located')
+    stat = os.stat(source_path)
+    if (os.path.exists(cache_path) and os.path.exists(located_path)
+            and matches_stat(read_manifest(manifest_path), stat)):
+        return read_arrow(located_path if located_only else cache_path)
+
+    raw = load_incidents(source_path)
+    processed = raw.copy()
+    processed['RowKey'] = row_keys(raw)
+    processed['RowHash'] = row_hashes(raw)
+    # Coordinates entered in the sheet itself are taken as they are.
+    for column in FLOAT_COLUMNS:
+        processed[column] = raw[column] if column in raw else np.nan
+
+    keys = pd.MultiIndex.from_frame(processed[['RowKey', 'RowHash']])
+    if os.path.exists(cache_path):
+        previous = read_arrow(cache_path).set_index(['RowKey', 'RowHash'])
+        known = previous[['City', 'lat', 'lon']].reindex(keys)
+        known.index = processed.index
+        resolved = processed['lat'].isna() & known['lat'].notna()
+        processed.loc[resolved, 'lat'] = known.loc[resolved, 'lat']
+        processed.loc[resolved, 'lon'] = known.loc[resolved, 'lon']
+        processed.loc[resolved, 'City'] = known.loc[resolved, 'City']
+
+    pending = processed['lat'].isna()
+    if pending.any():
+        fresh = preprocess(raw[pending].copy())
+        processed.loc[pending, 'City'] = fresh['City']
+        processed.loc[pending, 'lat'] = fresh['lat']
+        processed.loc[pending, 'lon'] = fresh['lon']
+
+    # Stored in date order so IncidentIndex can binary-search date ranges
+    # without re-sorting on every load.
+    processed = processed.sort_values('Date', kind='stable').reset_index(drop=True)
+    write_arrow(cache_path, processed)
+    write_arrow(located_path, processed.dropna(subset=FLOAT_COLUMNS).reset_index(drop=True))
+    manifest = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    write_atomic(manifest_path, lambda path: write_json(path, manifest))
+    # Hand back the mapped copy rather than the one built here.
+    return read_arrow(located_path if located_only else cache_path)
@@ -1,70 +1,44 @@
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
 import folium
-from folium.plugins import HeatMap, MarkerCluster
-from streamlit_folium import folium_static
-from geopy.geocoders import Nominatim
+from folium.plugins import HeatMap
+from streamlit_folium import folium_static, st_folium
 import plotly.graph_objs as go
 import random
 import plotly.express as px
-from fuzzywuzzy import process
+from heatmap_grid import density_grid
+from incident_engine import facet_filters, get_engine
+from incident_export import EXPORT_FORMATS, export_file
+from base_map import FeatureProperties, create_base_map, publish_boundaries
+from map_clustering import cluster_points
+from popup_cache import PopupCache
+from rollup_cube import BUCKET_NAMES, trend_bucket
+from table_pages import PAGE_SIZES, format_page, page_positions
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
 from streamlit_plotly_events import plotly_events
 import datetime
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 from st_aggrid.shared import JsCode
-@st.cache_data
-def load_data():
-    data = pd.read_excel('News GIS.xlsx', engine='openpyxl')
-    data['Date'] = pd.to_datetime(data['Date'])
-    return data
-
-@st.cache_data
-def load_world():
-    url = "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_countries.geojson"
-    return gpd.read_file(url)
-
-@st.cache_data
-def load_world_cities():
-    return pd.read_csv('worldcities.csv')
-
-@st.cache_data
-def fuzzy_match_city(city_name, limit=5, threshold=70):
-    cities = load_world_cities()['city'].unique()
-    matches = process.extract(city_name, cities, limit=limit)
-    return [match for match, score in matches if score >= threshold]
-
-@st.cache_data
-def geocode(city, country):
-    geolocator = Nominatim(user_agent="my_app")
-    try:
-        location = geolocator.geocode(f"{city}, {country}")
-        if location:
-            return (location.latitude, location.longitude)
-    except:
-        pass
-    return None
-
-@st.cache_data
-def preprocess_data(data):
-    def geocode_and_correct(row):
-        coords = geocode(row['City'], row['Country'])
-        if coords is None:
-            matches = fuzzy_match_city(row['City'])
-            if matches:
-                for match in matches:
-                    coords = geocode(match, row['Country'])
-                    if coords:
-                        row['City'] = match
-                        break
-        return pd.Series({'Coordinates': coords, 'City': row['City']})
-
-    result = data.apply(geocode_and_correct, axis=1)
-    data['Coordinates'] = result['Coordinates']
-    data['City'] = result['City']
-    return data
+
+def is_not_black(color):
+    # Convert hex to RGB
+    r, g, b = int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)
+
+    return (r + g + b) > 60
+
+# Bar colours for the trend chart, derived once at import.
+TREND_COLORS = [color for color in px.colors.qualitative.Plotly + px.colors.qualitative.D3 +
+                px.colors.qualitative.G10 + px.colors.qualitative.T10 + px.colors.qualitative.Alphabet
+                if is_not_black(color)]
+
+DISPLAY_COLUMNS = ['Category','Title', 'Country', 'City', 'Date', 'Casualty', 'Injury', 'Impact', 'Severity', 'Link']
+
+# Only called while drawing the incident map, so the borders are read and
+# published the first time a map is shown rather than at startup.
+@st.cache_resource
+def load_border_levels():
+    return publish_boundaries(st.get_option('server.baseUrlPath'))
 
 def get_marker_icon(category):
     icons = {
@@ -127,88 +101,90 @@ def create_popup_content(row):
     """
     return html
 
-@st.cache_data
-def filter_data(data, type_filter, category_filter, country_filter, impact_filter, severity_filter, start_date, end_date, search_term):
-    filtered_data = data
-    if type_filter:
-        filtered_data = filtered_data[filtered_data['Type'].isin(type_filter)]
-    if category_filter:
-        filtered_data = filtered_data[filtered_data['Category'].isin(category_filter)]
-    if country_filter:
-        filtered_data = filtered_data[filtered_data['Country'].isin(country_filter)]
-    if impact_filter:
-        filtered_data = filtered_data[filtered_data['Impact'].isin(impact_filter)]
-    if severity_filter:
-        filtered_data = filtered_data[filtered_data['Severity'].isin(severity_filter)]
-    
-    filtered_data = filtered_data[(filtered_data['Date'] >= start_date) & (filtered_data['Date'] <= end_date)]
-
-    if search_term:
-        filtered_data = filtered_data[filtered_data['Title'].str.contains(search_term, case=False) |
-                                      filtered_data['Country'].str.contains(search_term, case=False) |
-                                      filtered_data['City'].str.contains(search_term, case=False)]
-    
-    return filtered_data
-
-from folium.plugins import MarkerCluster
-
-def create_folium_map(filtered_data, world, selected_categories=None):
-    m = folium.Map(location=[0, 0], zoom_start=3, tiles=None, max_bounds=True)
+@st.cache_resource
+def get_popup_cache():
+    return PopupCache(create_popup_content)
+
+def show_incident_details(incidents):
+    popup_cache = get_popup_cache()
+    for _, row in incidents.iterrows():
+        st.markdown(popup_cache.get(row), unsafe_allow_html=True)
+
+def create_cluster_marker(cluster, incidents, max_titles=10):
+    count = int(cluster.count)
+    if count < 10:
+        color = 'rgba(110, 204, 57, 0.8)'
+    elif count < 100:
+        color = 'rgba(240, 194, 12, 0.8)'
+    else:
+        color = 'rgba(241, 128, 23, 0.8)'
+    size = 30 if count < 100 else 40
+    icon = folium.DivIcon(
+        html=f"""
+        <div style="background-color: {color}; width: {size}px; height: {size}px; border-radius: 50%;
+                    display: flex; align-items: center; justify-content: center;
+                    font: bold 12px Arial, sans-serif; border: 2px solid white;">{count}</div>
+        """,
+        icon_size=(size, size),
+        icon_anchor=(size // 2, size // 2),
+    )
+    # Points that still share a cell at street level are usually the same
+    # city, so the popup lists them instead of relying on further zooming.
+    members = incidents.iloc[cluster.members[:max_titles]]
+    items = ''.join(f'<li><a href="{row.Link}" target="_blank">{row.Title}</a></li>'
+                    for row in members[['Title', 'Link']].itertuples())
+    more = f"<p>and {count - max_titles} more. Zoom in to see them.</p>" if count > max_titles else ''
+    return folium.Marker(
+        location=[cluster.lat, cluster.lon],
+        icon=icon,
+        tooltip=f"{count} incidents",
+        popup=folium.Popup(f"<ul>{items}</ul>{more}", max_width=350),
+    )
 
-    folium.TileLayer(
-        tiles='https://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}',
-        attr='Google',
-        name='Google Maps',
-        overlay=False,
-        control=True,
-        show=True,
-        no_wrap=True,
-        min_zoom=3,
-        max_zoom=18,
-        detect_retina=True,
-        opacity=1.0,
-        subdomains=['mt0', 'mt1', 'mt2', 'mt3'],
-        bounds=[[-90, -180], [90, 180]]
-    ).add_to(m)
-
-    folium.GeoJson(
-        world,
-        style_function=lambda feature: {
-            'fillColor': 'transparent',
-            'color': '#bcbcbc',
-            'weight': 1,
-            'fillOpacity': 0,
-        }
-    ).add_to(m)
-
-    marker_cluster = MarkerCluster(
-        options={
-            'spiderfyOnMaxZoom': True,
-            'spiderLegPolylineOptions': {'weight': 1.5, 'color': '#222', 'opacity': 0.5},
-            'zoomToBoundsOnClick': True,
-            'noWrap': True  
-        }
-    ).add_to(m)
-
-    for idx, row in filtered_data.iterrows():
-        if row['Coordinates'] and None not in row['Coordinates']:
-            if selected_categories is None or row['Category'] in selected_categories:
-                icon = folium.Icon(icon=get_marker_icon(row['Category']), 
-                                   prefix='fa', 
-                                   color=get_marker_color(row['Category']))
-                
-                folium.Marker(
-                    location=row['Coordinates'],
-                    popup=folium.Popup(create_popup_content(row), max_width=350),
-                    tooltip=row['Title'],
-                    icon=icon
-                ).add_to(marker_cluster)
-
-
-    m.fit_bounds([[-90, -180], [90, 180]])
-
-    return m
-def create_heatmap(heat_data):
+def viewport_bounds(view):
+    bounds = view.get('bounds') or {}
+    south_west, north_east = bounds.get('_southWest') or {}, bounds.get('_northEast') or {}
+    if None in (south_west.get('lat'), south_west.get('lng'), north_east.get('lat'), north_east.get('lng')):
+        return None
+    return [[south_west['lat'], south_west['lng']], [north_east['lat'], north_east['lng']]]
+
+# Only the markers change between reruns; they are sent as a separate layer
+# that st_folium swaps into the already mounted base map.
+def create_incident_layer(filtered_data, selected_categories=None, zoom=3, bounds=None):
+    layer = folium.FeatureGroup(name='Incidents')
+
+    located = filtered_data['lat'].notna() & filtered_data['lon'].notna()
+    if selected_categories is not None:
+        located &= filtered_data['Category'].isin(selected_categories)
+    incidents = filtered_data[located]
+
+    clusters = cluster_points(incidents['lat'], incidents['lon'], zoom, bounds)
+    for cluster in clusters.itertuples():
+        if cluster.count > 1:
+            create_cluster_marker(cluster, incidents).add_to(layer)
+            continue
+        row = incidents.iloc[cluster.members[0]]
+        icon = folium.Icon(icon=get_marker_icon(row['Category']), 
+                           prefix='fa', 
+                           color=get_marker_color(row['Category']))
+        
+        # No popup is embedded; the marker carries the incident's row id and
+        # clicking it renders the popup on demand below the map (see
+        # show_incident_details).
+        marker = folium.Marker(
+            location=[row['lat'], row['lon']],
+            tooltip=row['Title'],
+            icon=icon
+        )
+        FeatureProperties({'incident_id': int(row.name)}).add_to(marker)
+        marker.add_to(layer)
+
+    return layer
+# Incidents are binned per grid cell at the zoom the map opens at; leaflet.heat
+# expects intensities up to 1, so cell weights are scaled to the busiest cell.
+def create_heatmap(filtered_data, zoom=3):
+    grid = density_grid(filtered_data['lat'], filtered_data['lon'], zoom)
+    grid['weight'] /= grid['weight'].max() if len(grid) else 1
     heatmap = folium.Map(location=[0, 0], zoom_start=2, tiles=None, max_bounds=True)
     
     folium.TileLayer(
@@ -228,7 +204,7 @@ def create_heatmap(heat_data):
         bounds=[[-90, -180], [90, 180]]
     ).add_to(heatmap)
 
-    HeatMap(heat_data).add_to(heatmap)
+    HeatMap(grid[['lat', 'lon', 'weight']].to_numpy().tolist()).add_to(heatmap)
     
     return heatmap
 
@@ -236,10 +212,8 @@ def main():
     st.set_page_config(layout="wide")
     st.title("CBRNE Incident Map")
 
-    data = load_data()
-    world = load_world()
-    
-    data = preprocess_data(data)
+    view = get_engine('News GIS.xlsx').view()
+    data = view.data
 
     search_term = st.text_input("Search incidents", "")
     
@@ -289,7 +263,8 @@ def main():
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
 
-    filtered_data = filter_data(data, type_filter, category_filter, country_filter, impact_filter, severity_filter, start_date, end_date, search_term)
+    facets = facet_filters(type_filter, category_filter, country_filter, impact_filter, severity_filter)
+    filtered_data = view.filter(facets, start_date, end_date, search_term)
 
     tab1, tab2, tab3 = st.tabs(["Incident Map", "Heatmap", "Data"])
 
@@ -298,13 +273,31 @@ def main():
         
 
         selected_categories = st.session_state.get('selected_categories', None)
-        m = create_folium_map(filtered_data, world, selected_categories)
-        
-
-        folium_static(m, width=1400, height=500)
+        # Clusters are computed server-side for the zoom and bounds the map
+        # last reported, so only what is on screen is sent to the browser.
+        map_view = st.session_state.get('incident_map') or {}
+        zoom = map_view.get('zoom') or 3
+        center = map_view.get('center')
+        incident_layer = create_incident_layer(filtered_data, selected_categories, zoom, viewport_bounds(map_view))
+
+        map_state = st_folium(
+            create_base_map(load_border_levels()),
+            feature_group_to_add=incident_layer,
+            key='incident_map',
+            width=1400,
+            height=500,
+            zoom=zoom,
+            center=(center['lat'], center['lng']) if center else None,
+            returned_objects=['zoom', 'bounds', 'center', 'last_active_drawing'],
+        )
+        # Cluster markers carry no incident id.
+        clicked = ((map_state or {}).get('last_active_drawing') or {}).get('properties') or {}
+        if 'incident_id' in clicked:
+            show_incident_details(data.loc[data.index.intersection([clicked['incident_id']])])
         
 
-        category_counts = filtered_data['Category'].value_counts()
+        category_counts = view.counts(filtered_data, 'Category', facets, start_date, end_date, search_term)
+        category_counts = category_counts.sort_values(ascending=False, kind='stable')
         color_map = {
             'Explosive': 'black',
             'Biological': 'green',
@@ -348,7 +341,8 @@ def main():
             del st.session_state['selected_categories']
 
 
-        country_counts = filtered_data['Country'].value_counts().reset_index()
+        country_counts = view.counts(filtered_data, 'Country', facets, start_date, end_date, search_term)
+        country_counts = country_counts.sort_values(ascending=False, kind='stable').reset_index()
         country_counts.columns = ['Country', 'Count']
 
      
@@ -376,36 +370,18 @@ def main():
         st.plotly_chart(fig2, use_container_width=True)
 
         st.subheader("Trend of Articles Over Time")
-        articles_by_date = filtered_data.groupby('Date').size().reset_index(name='count')
-
-
-        color_scales = [
-            px.colors.qualitative.Plotly,
-            px.colors.qualitative.D3,
-            px.colors.qualitative.G10,
-            px.colors.qualitative.T10,
-            px.colors.qualitative.Alphabet
-        ]
-
-        all_colors = []
-        for scale in color_scales:
-            all_colors.extend(scale)
-
-    
-        def is_not_black(color):
-            # Convert hex to RGB
-            r, g, b = int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)
-
-            return (r + g + b) > 60  
-
-        filtered_colors = [color for color in all_colors if is_not_black(color)]
+        # Bars are days, weeks, months or years, whichever keeps the range
+        # within MAX_TREND_BARS bars.
+        bucket = trend_bucket(start_date, end_date)
+        articles_by_date = view.counts(filtered_data, bucket, facets, start_date, end_date, search_term)
+        articles_by_date = articles_by_date.rename_axis('Date').reset_index(name='count')
 
         fig3 = px.bar(
             articles_by_date, 
             x='Date', 
             y='count',
             labels={'count': 'Number of Articles', 'Date': 'Date'},
-            title="Articles Published Over Time"
+            title=f"Articles Published Over Time (per {BUCKET_NAMES[bucket]})"
         )
         fig3.update_layout(
             template="plotly_white",
@@ -415,7 +391,7 @@ def main():
             showlegend=False
         )
         fig3.update_traces(
-            marker_color=filtered_colors,  # Use the filtered color palette
+            marker_color=TREND_COLORS,  # Use the filtered color palette
             hovertemplate="<b>Date</b>: %{x}<br><b>Articles</b>: %{y}"
         )
         st.plotly_chart(fig3, use_container_width=True)
@@ -423,34 +399,43 @@ def main():
     with tab2:
         st.subheader("Incident Heatmap")
 
-        link_counts = filtered_data.groupby(['Country', 'City'])['Link'].count().reset_index()
-        link_counts = link_counts.rename(columns={'Link': 'LinkCount'})
-        heatmap_data = pd.merge(filtered_data, link_counts, on=['Country', 'City'])
-
-        heat_data = heatmap_data[heatmap_data['Coordinates'].notna()][['Coordinates', 'LinkCount']]
-        heat_data['lat'] = heat_data['Coordinates'].apply(lambda x: x[0])
-        heat_data['lon'] = heat_data['Coordinates'].apply(lambda x: x[1])
-        heat_data = heat_data[['lat', 'lon', 'LinkCount']].values.tolist()
-
-        heatmap = create_heatmap(heat_data)
+        heatmap = create_heatmap(filtered_data)
         folium_static(heatmap, width=1400)
 
 
     with tab3:
         st.subheader("Filtered Data")
-        display_columns = ['Category','Title', 'Country', 'City', 'Date', 'Casualty', 'Injury', 'Impact', 'Severity', 'Link']
-        df_display = filtered_data[display_columns].copy()
-        df_display['Date'] = df_display['Date'].dt.strftime('%d-%m-%Y')
 
-        # Add export button
-        csv = df_display.to_csv(index=False)
+        # Add export button. The file is only written when the button is
+        # clicked, on a separate thread from the rerun.
+        export_format = st.radio("Export format", list(EXPORT_FORMATS), horizontal=True)
+        extension, mime = EXPORT_FORMATS[export_format]
+        export_data = filtered_data[DISPLAY_COLUMNS]
         st.download_button(
             label="Export Data",
-            data=csv,
-            file_name="filtered_data.csv",
-            mime="text/csv",
+            data=lambda: export_file(export_data, extension),
+            file_name=f"filtered_data.{extension}",
+            mime=mime,
         )
 
+        # Only the page on screen is sorted, formatted and sent to the grid.
+        sort_col, order_col, size_col, page_col = st.columns(4)
+        with sort_col:
+            sort_column = st.selectbox("Sort by", DISPLAY_COLUMNS, index=DISPLAY_COLUMNS.index('Date'))
+        with order_col:
+            descending = st.checkbox("Descending")
+        with size_col:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1)
+        page_count = max(1, -(-len(filtered_data) // page_size))
+        with page_col:
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+
+        ranks = view.sort_ranks(DISPLAY_COLUMNS)
+        positions = page_positions(filtered_data.index, ranks[sort_column], page - 1, page_size, descending)
+        df_display = format_page(view.data.iloc[positions][DISPLAY_COLUMNS])
+        first_row = (page - 1) * page_size
+        st.caption(f"Rows {min(first_row + 1, len(filtered_data))}-{first_row + len(df_display)} of {len(filtered_data)}")
+
         gb = GridOptionsBuilder.from_dataframe(df_display, editable=True)
         gb.configure_column("Category", minWidth=100)
         gb.configure_column("Title", minWidth=400)
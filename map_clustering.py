@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Edge of a grid cell in screen pixels. Every cell holding more than one
+# incident is drawn as a single cluster marker, so the number of markers on
+# screen is bounded by the viewport size rather than by the incident count.
+CELL_PIXELS = 60
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+# Share of the viewport added on each side so small pans don't leave the
+# edges empty until the next rerun.
+VIEWPORT_PADDING = 0.25
+
+
+def mercator(lat, lon):
+    # Normalised web-mercator coordinates in [0, 1), matching Leaflet's tiles.
+    x = (np.asarray(lon) + 180) / 360
+    sin = np.sin(np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return x, y
+
+
+def in_bounds(lat, lon, bounds, padding=VIEWPORT_PADDING):
+    (south, west), (north, east) = bounds
+    lat_pad, lon_pad = (north - south) * padding, (east - west) * padding
+    south, north, west, east = south - lat_pad, north + lat_pad, west - lon_pad, east + lon_pad
+    inside = (lat >= south) & (lat <= north)
+    if east - west >= 360:
+        return inside
+    # Leaflet reports longitudes past +/-180 once the map has been panned
+    # across the antimeridian.
+    west, east = (west + 180) % 360 - 180, (east + 180) % 360 - 180
+    if west <= east:
+        return inside & (lon >= west) & (lon <= east)
+    return inside & ((lon >= west) | (lon <= east))
+
+
+# Numbers the non-empty cells of a grid of cell_pixels-sized squares at the
+# given zoom and returns, for every point, the number of its cell, together
+# with the size of each cell. Fractional zooms give the in-between scale
+# rather than being rounded. Only occupied cells exist, so memory doesn't
+# grow with the zoom level.
+def grid_cells(lat, lon, zoom, cell_pixels=CELL_PIXELS):
+    x, y = mercator(lat, lon)
+    cells_per_axis = int(np.ceil(TILE_SIZE * 2 ** zoom / cell_pixels))
+    ix = np.minimum((x * cells_per_axis).astype(np.int64), cells_per_axis - 1)
+    iy = np.minimum((y * cells_per_axis).astype(np.int64), cells_per_axis - 1)
+    _, inverse, counts = np.unique(iy * cells_per_axis + ix, return_inverse=True, return_counts=True)
+    return inverse, counts
+
+
+# Buckets the points into screen-sized grid cells for the given zoom level and
+# returns one row per non-empty cell: the centroid, the member count and the
+# positions (into lat/lon) of its members. Only points inside `bounds`
+# ([[south, west], [north, east]]) are considered when it is given.
+def cluster_points(lat, lon, zoom, bounds=None, cell_pixels=CELL_PIXELS):
+    lat, lon = np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')
+    positions = np.arange(len(lat))
+    if bounds is not None:
+        positions = np.flatnonzero(in_bounds(lat, lon, bounds))
+    if len(positions) == 0:
+        return pd.DataFrame({'lat': [], 'lon': [], 'count': [], 'members': []})
+
+    inverse, counts = grid_cells(lat[positions], lon[positions], zoom, cell_pixels)
+
+    order = np.argsort(inverse, kind='stable')
+    members = np.split(positions[order], np.cumsum(counts)[:-1])
+    return pd.DataFrame({
+        'lat': np.bincount(inverse, weights=lat[positions]) / counts,
+        'lon': np.bincount(inverse, weights=lon[positions]) / counts,
+        'count': counts,
+        'members': members,
+    })
+
+
+# Thins the points to one marker per non-empty grid cell at `zoom`, placed at
+# the centroid of the cell's points and carrying their count, so nothing is
+# lost from the totals. A cell holding a single point keeps it exactly, with
+# its position (into lat/lon); aggregated cells have position -1.
+def thin_points(lat, lon, zoom, cell_pixels=CELL_PIXELS):
+    lat, lon = np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')
+    if len(lat) == 0:
+        return pd.DataFrame({'lat': [], 'lon': [], 'count': [], 'position': []})
+    inverse, counts = grid_cells(lat, lon, zoom, cell_pixels)
+    position = np.full(len(counts), -1, dtype=np.int64)
+    single = np.flatnonzero(counts[inverse] == 1)
+    position[inverse[single]] = single
+    return pd.DataFrame({
+        'lat': np.bincount(inverse, weights=lat) / counts,
+        'lon': np.bincount(inverse, weights=lon) / counts,
+        'count': counts,
+        'position': position,
+    })
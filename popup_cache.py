@@ -0,0 +1,20 @@
+from result_cache import ResultCache
+
+MAX_ENTRIES = 10000
+
+
+class PopupCache:
+    # Popup HTML is rendered only when someone opens an incident, and is kept
+    # under the row's content hash (RowHash from the incident store) plus the
+    # geocoded City and coordinates, which RowHash doesn't cover, so an
+    # unchanged incident is rendered once per process however many reruns
+    # show it, and an edited or re-geocoded one gets a fresh entry. Least
+    # recently opened entries are dropped past max_entries.
+    def __init__(self, render, max_entries=MAX_ENTRIES):
+        self.render = render
+        self._cache = ResultCache(max_entries, max_bytes=None)
+
+    def get(self, row):
+        # NaN never equals itself, so missing values are keyed as None.
+        key = tuple(None if value != value else value for value in (row['RowHash'], row['City'], row['lat'], row['lon']))
+        return self._cache.get(key, lambda: self.render(row))
@@ -0,0 +1,85 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from plotly.basedatatypes import BaseFigure
+
+MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_ENTRIES', '64'))
+MAX_BYTES = int(os.environ.get('RESULT_CACHE_MB', '256')) * 1024 * 1024
+
+
+def estimate_size(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(index=True, deep=False)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, BaseFigure):
+        # What the browser is sent, which is close to what the figure holds.
+        return len(value.to_json())
+    if isinstance(value, tuple):
+        return sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def freeze(value):
+    # numpy results are handed out read-only. DataFrames need nothing: with
+    # pandas' copy-on-write a caller's edits never reach the cached frame.
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        for item in value:
+            freeze(item)
+    return value
+
+
+# Plotly figures can't be made read-only, so every hit gets its own copy of
+# the cached one. That skips validation and takes a few milliseconds, where
+# rebuilding the figure or parsing it back from JSON takes hundreds.
+def share(value):
+    if isinstance(value, BaseFigure):
+        return type(value)(value)
+    return value
+
+
+class ResultCache:
+    # Results of work derived from the incident table, keyed by whatever
+    # identifies the inputs cheaply (the dataset version plus the filter
+    # parameters) rather than by hashing the inputs themselves, and handed
+    # back as the same object on every hit instead of a copy (figures aside,
+    # see share()). Least recently used entries are dropped past max_entries
+    # or once the estimated size of everything held passes max_bytes, if
+    # one is given.
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return share(self._entries[key][0])
+        value = freeze(compute())
+        size = estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                return share(self._entries[key][0])
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                              (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return share(value)
+
+
+# A hashable key for a facet selection; the order values were picked in
+# doesn't matter.
+def facets_key(facets):
+    return tuple((column, frozenset(selected)) for column, selected in sorted(facets.items()) if selected)
@@ -1,88 +1,31 @@
+import os
+
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
 import plotly.graph_objects as go
 import plotly.express as px
-from geopy.geocoders import Nominatim
-from fuzzywuzzy import process
+from heatmap_grid import density_grid
+from incident_engine import facet_filters, get_engine
+from incident_export import EXPORT_FORMATS, export_file
+from map_clustering import thin_points
+from popup_cache import PopupCache
+from rollup_cube import BUCKET_NAMES, trend_bucket
+from spiderfy import spider_layout
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 from st_aggrid.shared import JsCode
+from table_pages import PAGE_SIZES, format_page, page_positions
 from streamlit_plotly_events import plotly_events
 from plotly.subplots import make_subplots
 import numpy as np
-@st.cache_data
-def load_data():
-    data = pd.read_excel('News GIS.xlsx', engine='openpyxl')
-    data['Date'] = pd.to_datetime(data['Date'])
-    return data
-
-@st.cache_data
-def load_world():
-    url = "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_countries.geojson"
-    return gpd.read_file(url)
-
-@st.cache_data
-def load_world_cities():
-    return pd.read_csv('worldcities.csv')
-
-@st.cache_data
-def fuzzy_match_city(city_name, limit=5, threshold=70):
-    cities = load_world_cities()['city'].unique()
-    matches = process.extract(city_name, cities, limit=limit)
-    return [match for match, score in matches if score >= threshold]
-
-@st.cache_data
-def geocode(city, country):
-    geolocator = Nominatim(user_agent="my_app")
-    try:
-        location = geolocator.geocode(f"{city}, {country}")
-        if location:
-            return (location.latitude, location.longitude)
-    except:
-        pass
-    return None
-
-@st.cache_data
-def preprocess_data(data):
-    def geocode_and_correct(row):
-        coords = geocode(row['City'], row['Country'])
-        if coords is None:
-            matches = fuzzy_match_city(row['City'])
-            if matches:
-                for match in matches:
-                    coords = geocode(match, row['Country'])
-                    if coords:
-                        row['City'] = match
-                        break
-        return pd.Series({'Coordinates': coords, 'City': row['City']})
-
-    result = data.apply(geocode_and_correct, axis=1)
-    data['Coordinates'] = result['Coordinates']
-    data['City'] = result['City']
-    return data.dropna(subset=['Coordinates'])
-
-@st.cache_data
-def filter_data(data, type_filter, category_filter, country_filter, impact_filter, severity_filter, start_date, end_date, search_term):
-    filtered_data = data
-    if type_filter:
-        filtered_data = filtered_data[filtered_data['Type'].isin(type_filter)]
-    if category_filter:
-        filtered_data = filtered_data[filtered_data['Category'].isin(category_filter)]
-    if country_filter:
-        filtered_data = filtered_data[filtered_data['Country'].isin(country_filter)]
-    if impact_filter:
-        filtered_data = filtered_data[filtered_data['Impact'].isin(impact_filter)]
-    if severity_filter:
-        filtered_data = filtered_data[filtered_data['Severity'].isin(severity_filter)]
-    
-    filtered_data = filtered_data[(filtered_data['Date'] >= start_date) & (filtered_data['Date'] <= end_date)]
 
-    if search_term:
-        filtered_data = filtered_data[filtered_data['Title'].str.contains(search_term, case=False) |
-                                      filtered_data['Country'].str.contains(search_term, case=False) |
-                                      filtered_data['City'].str.contains(search_term, case=False)]
-    
-    return filtered_data
+DISPLAY_COLUMNS = ['Title', 'Country', 'City', 'Date', 'Casualty', 'Injury', 'Impact', 'Severity', 'Link']
+# Above LOD_POINTS incidents the map is drawn at a reduced level of detail:
+# each category is thinned to one marker per LOD_CELL_PIXELS grid cell, and
+# past DENSITY_POINTS it gives way to the density layer of the heatmap tab.
+MAP_ZOOM = 1.5
+LOD_POINTS = int(os.environ.get('MAP_LOD_POINTS', '20000'))
+DENSITY_POINTS = int(os.environ.get('MAP_DENSITY_POINTS', '250000'))
+LOD_CELL_PIXELS = 4
 
 def get_marker_color(category):
     colors = {
@@ -107,58 +50,46 @@ def create_popup_content(row):
     <a href="{row['Link']}" target="_blank">Read More</a>
     """
 
-@st.cache_data
-
-def create_plotly_map(filtered_data, selected_categories=None):
-    if selected_categories:
-        filtered_data = filtered_data[filtered_data['Category'].isin(selected_categories)]
-
-    fig = go.Figure()
-
-    # Group data by category
-    grouped_by_category = filtered_data.groupby('Category')
-
-    for category, group in grouped_by_category:
-        # Group data by coordinates within each category
-        grouped_by_coords = group.groupby('Coordinates')
-        
-        lats, lons, texts, custom_data, sizes = [], [], [], [], []
-        line_lats, line_lons = [], []
-        
-        for coords, coord_group in grouped_by_coords:
-            lat, lon = coords
-            if len(coord_group) == 1:
-                # Single point
-                row = coord_group.iloc[0]
-                lats.append(lat)
-                lons.append(lon)
-                texts.append(create_popup_content(row))
-                custom_data.append(row['Title'])
-                sizes.append(10)
-            else:
-
-                radius = 1  
-                angles = np.linspace(0, 2*np.pi, len(coord_group), endpoint=False)
-                
-          
-                lats.append(lat)
-                lons.append(lon)
-                texts.append(f"Cluster of {len(coord_group)} incidents")
-                custom_data.append(f"Cluster of {len(coord_group)} incidents")
-                sizes.append(15)  
-                
-                for idx, (_, row) in enumerate(coord_group.iterrows()):
-                    spider_lat = lat + radius * np.cos(angles[idx])
-                    spider_lon = lon + radius * np.sin(angles[idx])
-                    
-                    lats.append(spider_lat)
-                    lons.append(spider_lon)
-                    texts.append(create_popup_content(row))
-                    custom_data.append(row['Title'])
-                    sizes.append(8)  
-              
-                    line_lats.extend([lat, spider_lat, None])
-                    line_lons.extend([lon, spider_lon, None])
+@st.cache_resource
+def get_popup_cache():
+    return PopupCache(create_popup_content)
+
+def show_incident_details(incidents):
+    popup_cache = get_popup_cache()
+    for _, row in incidents.iterrows():
+        st.markdown(popup_cache.get(row), unsafe_allow_html=True)
+
+def add_spider_traces(fig, filtered_data):
+    # Spider positions and group sizes are computed for all incidents at
+    # once; each category trace is then assembled from array slices. Points
+    # carry only the title for hovering and the incident's row id, and the
+    # full popup is rendered when the point is clicked.
+    layout = spider_layout(filtered_data)
+    group_size = layout['group_size'].to_numpy()
+    first_in_group = layout['rank'].to_numpy() == 0
+    spider_lats = layout['spider_lat'].to_numpy()
+    spider_lons = layout['spider_lon'].to_numpy()
+    all_lats = filtered_data['lat'].to_numpy()
+    all_lons = filtered_data['lon'].to_numpy()
+    titles = filtered_data['Title'].to_numpy(dtype=object)
+    incident_ids = filtered_data.index.to_numpy()
+
+    for category, rows in filtered_data.groupby('Category', observed=True).indices.items():
+        spread = group_size[rows] > 1
+        # One larger marker at the shared location of every spread group
+        centers = rows[spread & first_in_group[rows]]
+        cluster_labels = ("Cluster of " + pd.Series(group_size[centers]).astype(str) + " incidents").to_numpy(dtype=object)
+
+        lats = np.concatenate([all_lats[centers], spider_lats[rows]])
+        lons = np.concatenate([all_lons[centers], spider_lons[rows]])
+        texts = np.concatenate([cluster_labels, titles[rows]])
+        custom_data = np.concatenate([np.full(len(centers), -1), incident_ids[rows]])
+        sizes = np.concatenate([np.full(len(centers), 15), np.where(spread, 8, 10)])
+
+        legs = rows[spread]
+        gaps = np.full(len(legs), np.nan)
+        line_lats = np.column_stack([all_lats[legs], spider_lats[legs], gaps]).ravel()
+        line_lons = np.column_stack([all_lons[legs], spider_lons[legs], gaps]).ravel()
 
         # Add markers
         fig.add_trace(go.Scattermapbox(
@@ -187,11 +118,69 @@ def create_plotly_map(filtered_data, selected_categories=None):
             showlegend=False
         ))
 
+# Markers keep no hover text: a lone incident carries just its row id, which
+# the click selection uses, and an aggregated cell carries -1 and shows its
+# count. Cells are binned a zoom level finer than the map opens at (see
+# create_plotly_heatmap for the tile scale), so zooming in a step still
+# separates them.
+def add_thinned_traces(fig, filtered_data, zoom):
+    all_lats = filtered_data['lat'].to_numpy()
+    all_lons = filtered_data['lon'].to_numpy()
+    incident_ids = filtered_data.index.to_numpy()
+
+    for category, rows in filtered_data.groupby('Category', observed=True).indices.items():
+        cells = thin_points(all_lats[rows], all_lons[rows], zoom + 2, LOD_CELL_PIXELS)
+        single = cells['position'].to_numpy() >= 0
+        singles, clusters = cells[single], cells[~single]
+        color = get_marker_color(category)
+
+        fig.add_trace(go.Scattermapbox(
+            lat=singles['lat'],
+            lon=singles['lon'],
+            mode='markers',
+            marker=go.scattermapbox.Marker(size=8, color=color, opacity=0.7),
+            hoverinfo='name',
+            name=category,
+            legendgroup=category,
+            customdata=incident_ids[rows[singles['position'].to_numpy()]],
+            showlegend=True
+        ))
+
+        fig.add_trace(go.Scattermapbox(
+            lat=clusters['lat'],
+            lon=clusters['lon'],
+            mode='markers',
+            marker=go.scattermapbox.Marker(
+                size=np.minimum(8 + 2 * np.log2(clusters['count'].to_numpy()), 24),
+                color=color,
+                opacity=0.7
+            ),
+            text=clusters['count'],
+            hovertemplate='%{text} incidents<extra>%{fullData.name}</extra>',
+            name=category,
+            legendgroup=category,
+            customdata=np.full(len(clusters), -1),
+            showlegend=False
+        ))
+
+def create_plotly_map(filtered_data, selected_categories=None, zoom=MAP_ZOOM):
+    if selected_categories:
+        filtered_data = filtered_data[filtered_data['Category'].isin(selected_categories)]
+
+    if len(filtered_data) > DENSITY_POINTS:
+        return create_plotly_heatmap(filtered_data, zoom)
+
+    fig = go.Figure()
+    if len(filtered_data) > LOD_POINTS:
+        add_thinned_traces(fig, filtered_data, zoom)
+    else:
+        add_spider_traces(fig, filtered_data)
+
     fig.update_layout(
         mapbox=dict(
             style="open-street-map",
             center=dict(lat=20, lon=0),
-            zoom=1.5,
+            zoom=zoom,
         ),
         showlegend=True,
         legend_title_text='Category',
@@ -201,16 +190,18 @@ def create_plotly_map(filtered_data, selected_categories=None):
 
     return fig
 
-@st.cache_data
-def create_plotly_heatmap(heat_data):
+# Mapbox tiles are 512 px, so its zoom 1.5 shows the world at the scale of a
+# 256 px tile map at zoom 2.5; the grid is binned at that resolution.
+def create_plotly_heatmap(filtered_data, zoom=MAP_ZOOM):
+    heat_data = density_grid(filtered_data['lat'], filtered_data['lon'], zoom + 1)
     fig = go.Figure(go.Densitymapbox(
         lat=heat_data['lat'],
         lon=heat_data['lon'],
-        z=heat_data['LinkCount'],
+        z=heat_data['weight'],
         radius=30,
         colorscale='Viridis',
         zmin=0,
-        zmax=heat_data['LinkCount'].max(),
+        zmax=heat_data['weight'].max(),
         showscale=True
     ))
 
@@ -218,7 +209,7 @@ def create_plotly_heatmap(heat_data):
         mapbox_style="open-street-map",
         mapbox=dict(
             center=dict(lat=20, lon=0),
-            zoom=1.5
+            zoom=zoom
         ),
         margin={"r":0,"t":0,"l":0,"b":0},
         height=600
@@ -230,10 +221,8 @@ def main():
     st.set_page_config(layout="wide")
     st.title("CBRNE Incident Map")
 
-    data = load_data()
-    world = load_world()
-    
-    data = preprocess_data(data)
+    view = get_engine('News GIS.xlsx').view(located_only=True)
+    data = view.data
 
     search_term = st.text_input("Search incidents", "")
     
@@ -282,7 +271,11 @@ def main():
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
 
-    filtered_data = filter_data(data, type_filter, category_filter, country_filter, impact_filter, severity_filter, start_date, end_date, search_term)
+    facets = facet_filters(type_filter, category_filter, country_filter, impact_filter, severity_filter)
+    filtered_data = view.filter(facets, start_date, end_date, search_term)
+    # Figures are cached per dataset version and filter set; each run gets
+    # its own copy of the cached one.
+    query = view.query_key(facets, start_date, end_date, search_term)
 
     tab1, tab2, tab3 = st.tabs(["Incident Map", "Heatmap", "Data"])
 
@@ -291,11 +284,17 @@ def main():
         
         # Map
         selected_categories = st.session_state.get('selected_categories', None)
-        fig = create_plotly_map(filtered_data, selected_categories)
-        st.plotly_chart(fig, use_container_width=True)
+        fig = view.cached('plotly_map', (query, tuple(selected_categories or ())),
+                          lambda: create_plotly_map(filtered_data, selected_categories))
+        event = st.plotly_chart(fig, use_container_width=True, key='incident_map',
+                                on_select='rerun', selection_mode='points')
+        selected_ids = [point['customdata'] for point in event.selection.points
+                        if point.get('customdata', -1) != -1]
+        show_incident_details(data.loc[data.index.intersection(selected_ids)])
 
         # Pie chart
-        category_counts = filtered_data['Category'].value_counts()
+        category_counts = view.counts(filtered_data, 'Category', facets, start_date, end_date, search_term)
+        category_counts = category_counts.sort_values(ascending=False, kind='stable')
         fig1 = px.pie(values=category_counts.values, names=category_counts.index, title="Distribution by Category")
         fig1.update_layout(
             template="plotly_dark",
@@ -326,7 +325,8 @@ def main():
         #st.plotly_chart(fig1, use_container_width=True)
 
         # Distribution chart
-        country_counts = filtered_data['Country'].value_counts().reset_index()
+        country_counts = view.counts(filtered_data, 'Country', facets, start_date, end_date, search_term)
+        country_counts = country_counts.sort_values(ascending=False, kind='stable').reset_index()
         country_counts.columns = ['Country', 'Count']
 
         color_sequence = px.colors.qualitative.Set3
@@ -352,13 +352,17 @@ def main():
         st.plotly_chart(fig2, use_container_width=True)
 
         st.subheader("Trend of Articles Over Time")
-        articles_by_date = filtered_data.groupby('Date').size().reset_index(name='count')
+        # Bars are days, weeks, months or years, whichever keeps the range
+        # within MAX_TREND_BARS bars.
+        bucket = trend_bucket(start_date, end_date)
+        articles_by_date = view.counts(filtered_data, bucket, facets, start_date, end_date, search_term)
+        articles_by_date = articles_by_date.rename_axis('Date').reset_index(name='count')
         fig3 = px.bar(
             articles_by_date, 
             x='Date', 
             y='count',
             labels={'count': 'Number of Articles', 'Date': 'Date'},
-            title="Articles Published Over Time"
+            title=f"Articles Published Over Time (per {BUCKET_NAMES[bucket]})"
         )
         fig3.update_layout(
             template="plotly_dark", 
@@ -375,28 +379,42 @@ def main():
 
     with tab2:
         st.subheader("Incident Heatmap")
-        heat_data = filtered_data.copy()
-        heat_data['lat'] = heat_data['Coordinates'].apply(lambda x: x[0])
-        heat_data['lon'] = heat_data['Coordinates'].apply(lambda x: x[1])
-        heat_data['LinkCount'] = 1
-        fig = create_plotly_heatmap(heat_data)
+        fig = view.cached('plotly_heatmap', query, lambda: create_plotly_heatmap(filtered_data))
         st.plotly_chart(fig, use_container_width=True)
 
     with tab3:
         st.subheader("Filtered Data")
-        display_columns = ['Title', 'Country', 'City', 'Date', 'Casualty', 'Injury', 'Impact', 'Severity', 'Link']
-        df_display = filtered_data[display_columns].copy()
-        df_display['Date'] = df_display['Date'].dt.strftime('%d-%m-%Y')
 
-        # Add export button
-        csv = df_display.to_csv(index=False)
+        # Add export button. The file is only written when the button is
+        # clicked, on a separate thread from the rerun.
+        export_format = st.radio("Export format", list(EXPORT_FORMATS), horizontal=True)
+        extension, mime = EXPORT_FORMATS[export_format]
+        export_data = filtered_data[DISPLAY_COLUMNS]
         st.download_button(
             label="Export Data",
-            data=csv,
-            file_name="filtered_data.csv",
-            mime="text/csv",
+            data=lambda: export_file(export_data, extension),
+            file_name=f"filtered_data.{extension}",
+            mime=mime,
         )
 
+        # Only the page on screen is sorted, formatted and sent to the grid.
+        sort_col, order_col, size_col, page_col = st.columns(4)
+        with sort_col:
+            sort_column = st.selectbox("Sort by", DISPLAY_COLUMNS, index=DISPLAY_COLUMNS.index('Date'))
+        with order_col:
+            descending = st.checkbox("Descending")
+        with size_col:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1)
+        page_count = max(1, -(-len(filtered_data) // page_size))
+        with page_col:
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+
+        ranks = view.sort_ranks(DISPLAY_COLUMNS)
+        positions = page_positions(filtered_data.index, ranks[sort_column], page - 1, page_size, descending)
+        df_display = format_page(view.data.iloc[positions][DISPLAY_COLUMNS])
+        first_row = (page - 1) * page_size
+        st.caption(f"Rows {min(first_row + 1, len(filtered_data))}-{first_row + len(df_display)} of {len(filtered_data)}")
+
         gb = GridOptionsBuilder.from_dataframe(df_display, editable=True)
 
         gb.configure_column("Title", minWidth=400)
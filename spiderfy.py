@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+SPIDER_RADIUS = 1
+
+
+# Incidents of the same category that share a location are fanned out on a
+# circle of `radius` degrees around it, in their original order. Returns, for
+# every row of `data`, the size of its location group, its rank within the
+# group and the position to draw it at; rows alone at their location keep
+# their own coordinates.
+def spider_layout(data, radius=SPIDER_RADIUS):
+    group_ids = data.groupby(['Category', 'lat', 'lon'], observed=True, sort=False).ngroup().to_numpy()
+    group_sizes = np.bincount(group_ids)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    order = np.argsort(group_ids, kind='stable')
+    rank = np.empty(len(data), dtype=np.int64)
+    rank[order] = np.arange(len(data)) - group_starts[group_ids[order]]
+
+    size = group_sizes[group_ids]
+    angle = 2 * np.pi * rank / size
+    spread = size > 1
+    lat, lon = data['lat'].to_numpy(), data['lon'].to_numpy()
+    return pd.DataFrame({
+        'group_size': size,
+        'rank': rank,
+        'spider_lat': np.where(spread, lat + radius * np.cos(angle), lat),
+        'spider_lon': np.where(spread, lon + radius * np.sin(angle), lon),
+    }, index=data.index)
+
+
+def legacy_spider_arrays(data, radius=SPIDER_RADIUS):
+    # The per-row loop spider_layout replaced, kept for the benchmark below.
+    arrays = {}
+    for category, group in data.groupby('Category', observed=True):
+        lats, lons, sizes, line_lats, line_lons = [], [], [], [], []
+        for (lat, lon), coord_group in group.groupby(['lat', 'lon']):
+            if len(coord_group) == 1:
+                lats.append(lat)
+                lons.append(lon)
+                sizes.append(10)
+                continue
+            angles = np.linspace(0, 2 * np.pi, len(coord_group), endpoint=False)
+            lats.append(lat)
+            lons.append(lon)
+            sizes.append(15)
+            for idx, (_, row) in enumerate(coord_group.iterrows()):
+                spider_lat = lat + radius * np.cos(angles[idx])
+                spider_lon = lon + radius * np.sin(angles[idx])
+                lats.append(spider_lat)
+                lons.append(spider_lon)
+                sizes.append(8)
+                line_lats.extend([lat, spider_lat, None])
+                line_lons.extend([lon, spider_lon, None])
+        arrays[category] = (lats, lons, sizes, line_lats, line_lons)
+    return arrays
+
+
+if __name__ == "__main__":
+    # Times Plotly map construction against the row-by-row spiderfy loop:
+    #   python spiderfy.py [incidents]
+    import sys
+    import time
+
+    from simple_map import create_plotly_map
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(0)
+    # City-level geocoding puts many incidents on the same few thousand points.
+    locations = rng.uniform([-60, -180], [70, 180], size=(n // 20, 2)).round(4)
+    picked = locations[rng.integers(0, len(locations), n)]
+    data = pd.DataFrame({
+        'Category': pd.Categorical(rng.choice(['Explosive', 'Biological', 'Radiological', 'Chemical', 'Nuclear'], n)),
+        'Title': [f"Incident {i}" for i in range(n)],
+        'Country': 'Country',
+        'City': 'City',
+        'Date': pd.Timestamp('2024-01-01'),
+        'Casualty': 0,
+        'Injury': 0,
+        'Impact': 'Human',
+        'Severity': 'Low',
+        'Link': 'https://example.com',
+        'lat': picked[:, 0],
+        'lon': picked[:, 1],
+    })
+
+    start = time.perf_counter()
+    legacy_spider_arrays(data)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    spider_layout(data)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    create_plotly_map(data)
+    figure = time.perf_counter() - start
+
+    print(f"{n} incidents  legacy loop: {legacy:.2f}s  spider_layout: {vectorized * 1000:.1f} ms "
+          f"({legacy / vectorized:.0f}x)  full create_plotly_map: {figure:.2f}s")